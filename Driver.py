@@ -3,6 +3,8 @@ import numpy as np
 import os
 import matplotlib.pyplot as plt
 import rasutils  
+import rasqueue
+import rasensemble
 
 # User must update the input options for the HEC-RAS model and results under the HEC-RAS Analysis.
 # User must update the heat map and 3D plot x and y plot labels as well as num_locations, num_locations_SP, and num_scenarios
@@ -37,7 +39,7 @@ import rasutils
 # To get the face point numbers for the "facepts.txt" file go to RasMapper.  Under a results file utilizing the same geometry, click on the 2D Flow Area.  Right click 
 # on a face point.  Click on Plot Time Series and click on Face Point: Velocity which will give the face point number for that point.  
 # Each evaluation parameter has a path that is referenced when reading the results HDF file.  This code that extracts the results from the HDF file is in the
-# rasutils.py file on lines 198-224.  You can update these paths for your model or additional variables you may want to analyze. 
+# rasutils.py file in the calculateResults function.  You can update these paths for your model or additional variables you may want to analyze. 
 
 optionsfile = "Options.txt" # Text file that includes the terrain and geometry options (culverts, bridges, etc.)
 scenariosfile = "Scenarios3.txt" # Text file that includes the scenario combinations by number 
@@ -48,11 +50,22 @@ facesfile = "faces.txt" # Face numbers for each of the cells
 faceptsfile = 'facepts.txt' # Face points numbers for each of the cells 
 HECresultsfile = 'BlackCreekModel.p07.hdf' # Results file, must be the same file that is loaded into model running
 minDepth = .00508 # Minimum depth value to be considered inundated or "wet" 
+# To run the scenarios on several computers set distributed to True.  The scenarios are published to the queue file, which must be in a 
+# directory shared with the worker computers.  Start Worker.py on each worker computer (with its own copy of the HEC-RAS project) 
+# and the results are collected here once all the scenarios have been run. 
+distributed = False # Run the scenarios with Worker.py on other computers 
+queuefile = "ScenarioQueue.db" # Queue file for the scenario jobs (in a shared directory) 
                       ########################
-geomHDF = geometryfile +'.g01.hdf' # If the geometry template file isn't .g01, lines 155, 163, and 177 in the rasutils must be updated with the correct geometry file template number as well 
-os.remove(geomHDF)
-# Run HEC-RAS for all scenarios and calculate results using the resulting hdf file.  Call runHECResults function. 
-depth, velocity, duration, percent_time_innundated, stream_power = rasutils.runHECResults(minDepth, optionsfile, scenariosfile, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile)
+if distributed: 
+    # Publish a job for every scenario and wait for the workers to return the results.  Call publishScenarios and collectResults functions. 
+    rasqueue.publishScenarios(queuefile, optionsfile, scenariosfile)
+    depth, velocity, duration, percent_time_innundated, stream_power = rasqueue.collectResults(queuefile)
+else: 
+    geomHDF = geometryfile +'.g01.hdf' # If the geometry template file isn't .g01, the runScenario function in rasutils must be updated with the correct geometry file template number as well 
+    rasutils.restoreTerrain(geometryfile) # Put the terrain file back if a run was stopped (must be before removing geomHDF)
+    os.remove(geomHDF)
+    # Run HEC-RAS for all scenarios and calculate results using the resulting hdf file.  Call runHECResults function. 
+    depth, velocity, duration, percent_time_innundated, stream_power = rasutils.runHECResults(minDepth, optionsfile, scenariosfile, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile)
 
 ########################## RESULTS ANALYSIS ##########################
 # Get results data in the right format and create a percent difference matrix compared to sceanrio 1. 
@@ -207,3 +220,50 @@ stream_power_array = np.array(stream_power_pandasDataFrame)
 stream_power_plot = stream_power_array[:,11:18]
 rasutils.plot3d(num_locations_SP, num_scenarios, ticks_x, ticks_y_StreamPower, stream_power_plot, "Stream Power" , " Stream Power", "3D_Plot_Stream Power") 
 
+########################## ENSEMBLE ANALYSIS ########################## 
+# Run parameter-perturbation ensembles around each scenario to put uncertainty bands on the results. 
+# Each ensemble member scales values in the geometry file (from the options file) by a random factor.  The results of each
+# member are added to running statistics as soon as the member finishes, so the members' results are not stored. 
+# The mean, lower, and upper bounds at each location are saved to csv files for each variable, for the raw results and 
+# the percent difference compared to Scenario 1 (each member is compared to the same member of Scenario 1). 
+# Where a member's Scenario 1 result is 0 its percent difference is left out of the statistics and counted in the nonFinite csv file. 
+
+                   ######## User Input ########
+# Note: 
+# The perturbations key is the text left of the = sign in the geometry file.  Add the position of the value after a colon for 
+# entries with a list of values, i.e. "Connection Culv:4" is the culvert Manning's n.  The value is the relative range, i.e. 0.2 is +/-20%. 
+# If distributed is True the members are published to ensembleQueuefile.  Start Worker.py with its queuefile set to ensembleQueuefile. 
+ensemble = False # Run the ensemble analysis 
+perturbations = {"Connection Culv:4": 0.2, "Conn Culv Bottom n": 0.2} # Geometry values to perturb and their relative range 
+members = 30 # Number of ensemble members for each scenario 
+seed = 0 # Random seed for the perturbation factors 
+confidence = [0.025, 0.975] # Quantiles for the lower and upper bounds (95% interval) 
+# The lower and upper quantile bounds are too narrow with fewer than about 100 members.  The normalLower and normalUpper bounds 
+# (mean +/- t * standard deviation) are also saved and should be used for smaller ensembles. 
+ensembleQueuefile = "EnsembleQueue.db" # Queue file for the ensemble jobs (in a shared directory) 
+                    ########################
+
+if ensemble: 
+    quantiles = [confidence[0], 0.5, confidence[1]]
+    
+    if distributed: 
+        # Publish a job for every member and add the results as the workers finish them.  Call publishEnsemble and collectEnsemble functions. 
+        rasensemble.publishEnsemble(ensembleQueuefile, optionsfile, scenariosfile, perturbations, members, seed)
+        ensemble_stats = rasensemble.collectEnsemble(ensembleQueuefile, scenariosfile, quantiles)
+    else: 
+        # Run HEC-RAS for every member of all scenarios.  Call runEnsemble function. 
+        ensemble_stats = rasensemble.runEnsemble(minDepth, optionsfile, scenariosfile, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile, 
+                                                 perturbations, members, seed, quantiles)
+    
+    if members < 100: 
+        print ("Fewer than 100 members, the lower and upper quantile bounds are too narrow. Use normalLower and normalUpper")
+    
+    # Save the mean, lower, and upper bounds for each variable to csv files 
+    for metric in rasqueue.metrics: 
+        for variable in [metric, metric + " percent difference"]: 
+            tables = rasensemble.ensembleTables(ensemble_stats, variable, confidence[0], confidence[1])
+            if not tables: # No results for this variable
+                continue
+            for table in ["mean", "lower", "upper", "normalLower", "normalUpper", "nonFinite"]: 
+                # Organize columns in number order (locations without results are left blank)
+                tables[table].reindex(columns = location_labels).to_csv("ensemble_" + variable.replace(" ", "_") + "_" + table + ".csv") 
@@ -0,0 +1,35 @@
+# Import functions 
+import os
+import rasutils
+import rasqueue
+
+# Worker for running the scenarios on several computers.  Driver.py publishes the scenarios to the queue file 
+# (set distributed = True in Driver.py) and each computer running this file claims scenarios from the queue, 
+# runs HEC-RAS, and sends the results back to Driver.py. 
+# Each worker computer needs its own copy of the HEC-RAS project folder, the terrain geometry HDF files from the Options file, 
+# and the cells, faces, and face points files.  Run this file from that project folder. 
+# Always check HEC-RAS is completely closed before starting.  Going to task manager is a good way to check this.
+# If a worker computer stops (or HEC-RAS is closed from the task manager) the scenario it was running is put back on the queue 
+# once the lease time runs out and another worker will run it. 
+
+                   ######## User Input ########
+# Inputs must match the inputs in Driver.py 
+queuefile = "//SharedDrive/RiverSET/ScenarioQueue.db" # Queue file for the scenario jobs (same file as in Driver.py, or ensembleQueuefile for ensembles)
+geometryfile = "BlackCreekModel" # Geometry file template for HEC-RAS (name should match text and HDF file name)
+RASfile = 'BlackCreekModel.prj' # HEC-RAS project file name
+cellsfile = "cells.txt" # Cell numbers for each location 
+facesfile = "faces.txt" # Face numbers for each of the cells
+faceptsfile = 'facepts.txt' # Face points numbers for each of the cells 
+HECresultsfile = 'BlackCreekModel.p07.hdf' # Results file, must be the same file that is loaded into model running
+minDepth = .00508 # Minimum depth value to be considered inundated or "wet" 
+leaseTime = 600 # Seconds before a scenario from a worker that stopped is put back on the queue 
+heartbeat = 60 # Seconds between lease renewals while HEC-RAS is running (must be less than leaseTime)
+                      ########################
+geomHDF = geometryfile +'.g01.hdf' # If the geometry template file isn't .g01, the runScenario function in rasutils must be updated with the correct geometry file template number as well 
+rasutils.restoreTerrain(geometryfile) # Put the terrain file back if the worker was stopped during a run (must be before removing geomHDF)
+if os.path.exists(geomHDF):
+    os.remove(geomHDF)
+# Run scenarios from the queue until all of them are finished.  Call runWorker function. 
+completed = rasqueue.runWorker(queuefile, minDepth, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile, 
+                               leaseTime = leaseTime, heartbeat = heartbeat)
+print ("Scenarios completed: " + str(completed))
@@ -0,0 +1,492 @@
+#Import functions
+import math
+from statistics import NormalDist
+import numpy as np
+import rasutils
+import rasqueue
+
+# rasensemble runs parameter-perturbation ensembles around each scenario to put uncertainty bands on the results.
+# Each ensemble member scales numeric values in the assembled geometry file (for example the culvert Manning's n
+# or weir coefficient from the options in the options file) by a random factor.  Member k uses the same factors
+# for every scenario so the scenarios are compared under the same perturbation: the percent difference of member k
+# is calculated against member k of Scenario 1.
+# Results from each member are folded into streaming statistics (mean/variance, min/max, and quantiles) as soon as the
+# member finishes, so memory stays the same no matter how many members are run.
+
+########################## STREAMING STATISTICS ##########################
+
+class P2Quantile:
+    """
+    P2Quantile estimates a quantile (p between 0 and 1) of a stream of values without storing them, using the
+    P-squared algorithm from "The P2 Algorithm for Dynamic Calculation of Quantiles and Histograms Without
+    Storing Observations" by Raj Jain and Imrich Chlamtac 1985.  Five markers are kept and adjusted as values are added.
+    Tail quantiles (i.e. 0.025 and 0.975) are biased toward the median with fewer than about 100 values, so for ensembles
+    of tens of members use RunningStats.interval for the bounds as well.
+
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.heights = [] # Marker heights (first 5 values are stored until the markers are set up)
+        self.positions = [1, 2, 3, 4, 5] # Actual marker positions
+        self.desired = [1, 1 + 2*p, 1 + 4*p, 3 + 2*p, 5] # Desired marker positions
+        self.increments = [0, p/2, p, (1 + p)/2, 1] # Increments of the desired positions for each value
+
+    def add(self, x):
+        q = self.heights
+        if len(q) < 5: # Store the first 5 values
+            q.append(x)
+            q.sort()
+            return
+
+        # Find the cell the value falls in and update the extreme markers
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+
+        n = self.positions
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Adjust the middle markers if they are off their desired positions
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise parabolic prediction of the marker height
+                qp = q[i] + d/(n[i + 1] - n[i - 1])*((n[i] - n[i - 1] + d)*(q[i + 1] - q[i])/(n[i + 1] - n[i])
+                                                   + (n[i + 1] - n[i] - d)*(q[i] - q[i - 1])/(n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]: # Use linear prediction if the parabolic one is out of order
+                    qp = q[i] + d*(q[i + d] - q[i])/(n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        """
+        Returns the quantile estimate.  Exact (linear interpolation) while there are 5 values or fewer.
+
+        """
+
+        if len(self.heights) == 0:
+            return np.nan
+        if len(self.heights) < 5 or self.positions[4] == 5:
+            return float(np.percentile(self.heights, self.p*100))
+        return self.heights[2]
+
+class RunningStats:
+    """
+    RunningStats keeps the count, mean and variance (Welford's method), minimum, maximum, and P2 quantile estimates
+    of a stream of values.  Values that aren't finite (inf or nan, i.e. percent difference from a baseline of 0) are
+    counted in nonFinite and left out, since a single one would make every statistic nan.
+
+    Inputs:
+    quantiles = List of quantiles to estimate, i.e. [0.025, 0.5, 0.975]
+
+    """
+
+    def __init__(self, quantiles = ()):
+        self.count = 0
+        self.nonFinite = 0 # Number of inf or nan values left out
+        self.mean = 0.0
+        self.m2 = 0.0 # Sum of squared differences from the mean
+        self.min = np.inf
+        self.max = -np.inf
+        self.quantiles = {p: P2Quantile(p) for p in quantiles}
+
+    def add(self, x):
+        x = float(x)
+        if not math.isfinite(x):
+            self.nonFinite += 1
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta/self.count
+        self.m2 += delta*(x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        for quantile in self.quantiles.values():
+            quantile.add(x)
+
+    def variance(self):
+        """
+        Returns the sample variance (nan with fewer than 2 values).
+
+        """
+
+        if self.count < 2:
+            return np.nan
+        return self.m2/(self.count - 1)
+
+    def std(self):
+        return np.sqrt(self.variance())
+
+    def quantile(self, p):
+        return self.quantiles[p].value()
+
+    def interval(self, lower = 0.025, upper = 0.975):
+        """
+        Returns the lower and upper bounds of the normal prediction interval for one more member,
+        mean + t*std*sqrt(1 + 1/count) with the Student t quantiles for lower and upper (nan with fewer than 2 values).
+        Unlike the P2 quantiles it is not biased for small ensembles, but assumes the values are normally distributed.
+
+        """
+
+        if self.count < 2:
+            return np.nan, np.nan
+        scale = self.std()*np.sqrt(1 + 1/self.count)
+        return (self.mean + studentT(lower, self.count - 1)*scale,
+                self.mean + studentT(upper, self.count - 1)*scale)
+
+def studentT(p, dof):
+    """
+    studentT returns the p quantile of the Student t distribution with dof degrees of freedom.  Exact for 1 and 2
+    degrees of freedom, otherwise the Cornish-Fisher expansion from Abramowitz and Stegun 26.7.5 (within 0.2% for 3 or more).
+
+    """
+
+    if dof == 1:
+        return math.tan(math.pi*(p - 0.5))
+    if dof == 2:
+        return (2*p - 1)/math.sqrt(2*p*(1 - p))
+
+    z = NormalDist().inv_cdf(p)
+    g1 = (z**3 + z)/4
+    g2 = (5*z**5 + 16*z**3 + 3*z)/96
+    g3 = (3*z**7 + 19*z**5 + 17*z**3 - 15*z)/384
+    g4 = (79*z**9 + 776*z**7 + 1482*z**5 - 1920*z**3 - 945*z)/92160
+
+    return z + g1/dof + g2/dof**2 + g3/dof**3 + g4/dof**4
+
+########################## ENSEMBLE MEMBERS ##########################
+
+def sampleFactors(perturbations, members, seed = 0):
+    """
+    sampleFactors draws the scaling factors for each ensemble member.
+
+    Inputs:
+    perturbations = Dictionary where the key is the geometry entry to perturb and the value is the relative range,
+                    i.e. {"Conn Culv Bottom n": 0.2} scales the value by a factor between 0.8 and 1.2 (see perturbGeometry)
+    members = Number of ensemble members
+    seed = Random seed so the ensemble can be repeated
+
+    Return:
+    factors = List (one per member) of dictionaries where the key is the geometry entry and the value is the factor
+
+    """
+
+    rng = np.random.default_rng(seed)
+    factors = []
+    for member in range(members):
+        factors.append({key: 1 + rng.uniform(-fraction, fraction) for key, fraction in perturbations.items()})
+
+    return factors
+
+def perturbGeometry(lines, factors, matched = None):
+    """
+    perturbGeometry scales numeric values in the geometry file lines.
+
+    Inputs:
+    lines = List of lines for the assembled geometry file (from rasutils.buildGeometry)
+    factors = Dictionary where the key is the geometry entry and the value is the factor.  The key is the text left of
+              the = sign in the geometry file.  Every line with that key gets its value scaled, i.e.
+              "Conn Culv Bottom n" (culvert bottom Manning's n) or "Conn Weir Coef" (weir coefficient).
+              For entries with a list of values separated by commas add the position (starting at 0) after a colon, i.e.
+              "Connection Culv:4" is the culvert Manning's n in "Connection Culv=1,0.81,,12.49,0.033,..."
+    matched = Optional set, the keys that matched a line are added to it
+
+    Return:
+    lines = New list of lines with the scaled values.  Raises a ValueError naming the key and line if the value isn't a number
+
+    """
+
+    # Split keys into the entry name and the position in the list of values (None for single values)
+    entries = {}
+    for key, factor in factors.items():
+        name, _, position = key.partition(":")
+        entries.setdefault(name, []).append((key, int(position) if position != "" else None, factor))
+
+    perturbed = []
+    for line in lines:
+        name, equals, values = line.partition("=")
+        if equals == "" or name not in entries:
+            perturbed.append(line)
+            continue
+
+        ending = values[len(values.rstrip('\n')):] # Keep the new line
+        values = values.rstrip('\n').split(',')
+        for key, position, factor in entries[name]:
+            index = 0 if position is None else position
+            try:
+                values[index] = '%.6g' % (float(values[index])*factor)
+            except (IndexError, ValueError):
+                raise ValueError("Perturbation " + key + " is not a number in line: " + line.rstrip('\n'))
+            if matched is not None:
+                matched.add(key)
+        perturbed.append(name + "=" + ','.join(values) + ending)
+
+    return perturbed
+
+def ensembleMembers(optionsfile, scenariosfile, perturbations, members, seed = 0):
+    """
+    ensembleMembers generates the geometry for every ensemble member of every scenario, one member at a time
+    (all scenarios for member 0, then all scenarios for member 1, ...).  Prints the scenarios where a perturbation
+    matches no line in the geometry, and raises a ValueError if it matches no line in any scenario.
+
+    Yields:
+    member, scenario, lines, fileEnding = Member number, scenario name, perturbed geometry file lines, and terrain geometry extension
+
+    """
+
+    allOptionsKeys, allOptions = rasutils.readOptions(optionsfile) # HEC-RAS options
+    scenarioOptions = rasutils.readScenarios(scenariosfile) # Scenario combinations
+
+    # Geometry file for each scenario before perturbation
+    geometries = {}
+    for scenario, options in scenarioOptions.items():
+        geometries[scenario] = rasutils.buildGeometry(allOptionsKeys, allOptions, options)
+
+    # Check the perturbations against each scenario's geometry before any member is run, so a typo
+    # doesn't give an ensemble with no spread
+    unused = set(perturbations)
+    for scenario, (lines, fileEnding) in geometries.items():
+        matched = set()
+        perturbGeometry(lines, {key: 1.0 for key in perturbations}, matched)
+        for key in perturbations:
+            if key not in matched:
+                print (scenario + ": perturbation " + key + " matches no line in the geometry")
+        unused -= matched
+    if unused:
+        raise ValueError("Perturbations match no line in the geometry of any scenario: " + ", ".join(sorted(unused)))
+
+    for member, factors in enumerate(sampleFactors(perturbations, members, seed)):
+        for scenario, (lines, fileEnding) in geometries.items():
+            yield member, scenario, perturbGeometry(lines, factors), fileEnding
+
+########################## RUN ENSEMBLE ##########################
+
+def foldResults(stats, scenario, results, quantiles = (0.025, 0.5, 0.975)):
+    """
+    foldResults adds the results of one ensemble member to the streaming statistics.
+
+    Inputs:
+    stats = Dictionary of RunningStats where the key is (metric, location, scenario).  Updated in place
+    scenario = Scenario name
+    results = Dictionary where the key is the metric name and the value is a dictionary of the result at each location
+              (see rasqueue.compactResults)
+    quantiles = Quantiles to estimate for new statistics
+
+    """
+
+    for metric, values in results.items():
+        for location, value in values.items():
+            stats.setdefault((metric, location, scenario), RunningStats(quantiles)).add(value)
+
+def foldPercentDifference(stats, scenario, results, baseline, quantiles = (0.025, 0.5, 0.975)):
+    """
+    foldPercentDifference adds the percent difference of one ensemble member from a baseline to the streaming statistics,
+    under the metric name + " percent difference".  Where the baseline is 0 the percent difference is inf or nan, the
+    same as rasutils.percentDifference, and is counted in RunningStats.nonFinite instead of being added.
+
+    Inputs:
+    stats, scenario, results, quantiles = See foldResults
+    baseline = Results of the same member for the scenario to compare to (i.e. Scenario 1), in the same format as results
+
+    """
+
+    for metric, values in results.items():
+        for location, value in values.items():
+            base = np.float64(baseline[metric][location])
+            with np.errstate(divide = 'ignore', invalid = 'ignore'): # inf or nan where the baseline is 0
+                percentDiff = ((value - base) / base) * 100 # Calculate percent difference compared to the baseline
+            stats.setdefault((metric + " percent difference", location, scenario), RunningStats(quantiles)).add(percentDiff)
+
+class EnsembleStats:
+    """
+    EnsembleStats folds the results of each ensemble member into the streaming statistics.  The percent difference
+    of each member is calculated against the same member's baseline scenario (the first scenario in the scenarios file,
+    i.e. Scenario 1), so the band shows the scenario effect under the same perturbation and the baseline row is 0.
+    Results of a member that arrive before its baseline are held until the baseline arrives, and the baseline is
+    dropped once all of the member's scenarios are folded.  Members run in order, so only a few members are held at once.
+
+    Inputs:
+    scenarios = List of scenario names, the first one is the baseline
+    quantiles = Quantiles to estimate (see RunningStats)
+
+    """
+
+    def __init__(self, scenarios, quantiles = (0.025, 0.5, 0.975)):
+        self.stats = {} # RunningStats where the key is (metric, location, scenario)
+        self.scenarios = list(scenarios)
+        self.baselineScenario = self.scenarios[0]
+        self.quantiles = quantiles
+        self.baselines = {} # Baseline results for each member still being folded
+        self.waiting = {} # Results for each member waiting for the member's baseline
+        self.folded = {} # Number of scenarios folded for each member
+
+    def add(self, scenario, member, results):
+        foldResults(self.stats, scenario, results, self.quantiles)
+
+        if scenario == self.baselineScenario:
+            self.baselines[member] = results
+            pending = [(scenario, results)] + self.waiting.pop(member, [])
+        elif member in self.baselines:
+            pending = [(scenario, results)]
+        else:
+            self.waiting.setdefault(member, []).append((scenario, results))
+            return
+
+        for name, memberResults in pending:
+            foldPercentDifference(self.stats, name, memberResults, self.baselines[member], self.quantiles)
+        self.folded[member] = self.folded.get(member, 0) + len(pending)
+        if self.folded[member] == len(self.scenarios): # Member finished
+            del self.baselines[member]
+            del self.folded[member]
+
+    def finish(self):
+        """
+        finish prints the results still waiting for a baseline that never arrived (the member's baseline job failed)
+        and drops them, so their percent difference is left out.  Call once every result has been added.
+
+        Return:
+        skipped = List of (scenario, member) whose percent difference was left out
+
+        """
+
+        skipped = []
+        for member, pending in sorted(self.waiting.items()):
+            for scenario, results in pending:
+                print (scenario + ", member " + str(member) + ": percent difference skipped: baseline failed")
+                skipped.append((scenario, member))
+        self.waiting = {}
+        self.baselines = {}
+        self.folded = {}
+
+        return skipped
+
+def runEnsemble(minDepth, optionsfile = "", scenariosfile = "", geometryfile = "", RASfile = "", cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = "",
+                perturbations = {}, members = 20, seed = 0, quantiles = (0.025, 0.5, 0.975), runModel = rasutils.runHEC):
+    """
+    runEnsemble runs every ensemble member of every scenario on this computer, one after the other, and folds the
+    results into the streaming statistics.  To run the members on several computers use publishEnsemble and collectEnsemble.
+
+    Inputs:
+    minDepth, optionsfile, scenariosfile, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile = Same as rasutils.runHECResults
+    perturbations, members, seed = See sampleFactors
+    quantiles = Quantiles to estimate (see RunningStats)
+    runModel = Function that runs the model, called with RASfile.  Defaults to rasutils.runHEC
+
+    Return:
+    stats = Dictionary of RunningStats where the key is (metric, location, scenario), including the percent difference
+            compared to the same member's Scenario 1 (see EnsembleStats)
+
+    """
+
+    ensemble = EnsembleStats(rasutils.readScenarios(scenariosfile), quantiles)
+    for member, scenario, lines, fileEnding in ensembleMembers(optionsfile, scenariosfile, perturbations, members, seed):
+        print (scenario + ", member " + str(member))
+        results = rasutils.runScenario(scenario, lines, fileEnding, minDepth, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile, runModel)
+        ensemble.add(scenario, member, rasqueue.compactResults(results, scenario))
+
+    return ensemble.stats
+
+def publishEnsemble(queuefile, optionsfile = "", scenariosfile = "", perturbations = {}, members = 20, seed = 0):
+    """
+    publishEnsemble publishes one job per ensemble member of every scenario to the queue so the members run in parallel
+    on the workers (see rasqueue.runWorker).  Use a different queue file than the one for the scenarios.  The queue is
+    cleared first so members left over from an earlier run aren't folded into the statistics (see rasqueue.clearQueue).
+
+    Return:
+    jobs = Number of jobs published
+
+    """
+
+    rasqueue.clearQueue(queuefile) # Start a new run
+    jobs = 0
+    for member, scenario, lines, fileEnding in ensembleMembers(optionsfile, scenariosfile, perturbations, members, seed):
+        rasqueue.publishJob(queuefile, scenario, lines, fileEnding, member)
+        jobs += 1
+
+    return jobs
+
+def collectEnsemble(queuefile, scenariosfile = "", quantiles = (0.025, 0.5, 0.975), poll = 10, maxAttempts = 3):
+    """
+    collectEnsemble folds the results of each ensemble member into the streaming statistics as soon as a worker finishes it,
+    until every job in the queue is finished.  Members that failed on every attempt are printed and left out, and so is the
+    percent difference of every scenario of a member whose baseline failed (see EnsembleStats.finish).
+
+    Inputs:
+    queuefile = SQLite queue file the ensemble was published to
+    scenariosfile = Text file that includes the scenario combinations by number (same file as for publishEnsemble)
+    quantiles = Quantiles to estimate (see RunningStats)
+
+    Return:
+    stats = Dictionary of RunningStats where the key is (metric, location, scenario) (see runEnsemble)
+
+    """
+
+    ensemble = EnsembleStats(rasutils.readScenarios(scenariosfile), quantiles)
+    for scenario, member, results in rasqueue.iterResults(queuefile, poll, maxAttempts):
+        ensemble.add(scenario, member, results)
+    ensemble.finish() # Members whose baseline failed
+
+    connection = rasqueue.openQueue(queuefile)
+    for scenario, member, error in connection.execute("SELECT scenario, member, error FROM jobs WHERE status = 'failed' ORDER BY id"):
+        print (scenario + ", member " + str(member) + " failed: " + str(error))
+    connection.close()
+
+    return ensemble.stats
+
+########################## RESULTS ANALYSIS ##########################
+
+def ensembleTables(stats, metric, lower = 0.025, upper = 0.975):
+    """
+    ensembleTables creates the scenario x location tables of the ensemble statistics for one metric, in the same
+    format as rasutils.toPandas.
+
+    Inputs:
+    stats = Dictionary of RunningStats (from runEnsemble or collectEnsemble)
+    metric = Metric name, i.e. "depth" or "depth percent difference" (see rasqueue.metrics)
+    lower, upper = Quantiles for the lower and upper bounds of the confidence interval.  Must be in the quantiles
+                   used for the statistics
+
+    Return:
+    tables = Dictionary of data frames for "count", "nonFinite" (members left out because the value was inf or nan, i.e.
+             percent difference from a baseline of 0), "mean", "std", "min", "max", "lower", "median" (if estimated), "upper"
+             (P2 quantiles), and "normalLower" and "normalUpper" (normal prediction interval, see RunningStats.interval).
+             Statistics are nan where no member had a finite value.
+             The P2 bounds are too narrow with fewer than about 100 members, use normalLower and normalUpper then
+
+    """
+
+    values = {"count": {}, "nonFinite": {}, "mean": {}, "std": {}, "min": {}, "max": {}, "lower": {}, "median": {}, "upper": {},
+              "normalLower": {}, "normalUpper": {}}
+    for (name, location, scenario), stat in stats.items():
+        if name != metric:
+            continue
+        values["count"][(location, scenario)] = stat.count
+        values["nonFinite"][(location, scenario)] = stat.nonFinite
+        values["mean"][(location, scenario)] = stat.mean if stat.count > 0 else np.nan
+        values["std"][(location, scenario)] = stat.std()
+        values["min"][(location, scenario)] = stat.min if stat.count > 0 else np.nan
+        values["max"][(location, scenario)] = stat.max if stat.count > 0 else np.nan
+        values["lower"][(location, scenario)] = stat.quantile(lower)
+        values["upper"][(location, scenario)] = stat.quantile(upper)
+        values["normalLower"][(location, scenario)], values["normalUpper"][(location, scenario)] = stat.interval(lower, upper)
+        if 0.5 in stat.quantiles:
+            values["median"][(location, scenario)] = stat.quantile(0.5)
+
+    tables = {}
+    for name, dictionary in values.items():
+        if dictionary:
+            tables[name] = rasutils.toPandas(dictionary)
+
+    return tables
@@ -0,0 +1,407 @@
+#Import functions
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import rasutils
+
+# rasqueue spreads the scenario runs over several worker machines.
+# The coordinator (Driver.py) publishes one job per scenario to a SQLite queue file in a shared directory.
+# Each job holds the assembled geometry file and the terrain reference (geometry HDF extension) for the scenario.
+# Workers (Worker.py) claim jobs with a lease, run HEC-RAS in their own copy of the project, calculate the results,
+# and return only the results at each location.  A worker keeps its lease alive with a heartbeat while HEC-RAS runs,
+# so jobs from a worker that stops (crash, power loss, HEC-RAS hangs) are put back on the queue once the lease expires.
+
+# Names of the results returned by rasutils.calculateResults, in the same order
+metrics = ["depth", "velocity", "duration", "percent_time_innundated", "stream_power"]
+
+########################## QUEUE ##########################
+
+def openQueue(queuefile):
+    """
+    openQueue opens (and creates if needed) the SQLite queue file and returns the connection.
+    The connection is in autocommit mode, transactions are started explicitly where jobs are claimed or updated.
+
+    """
+
+    connection = sqlite3.connect(queuefile, timeout = 60, isolation_level = None)
+    connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                              id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              scenario TEXT NOT NULL,
+                              member INTEGER,
+                              payload TEXT NOT NULL,
+                              status TEXT NOT NULL DEFAULT 'pending',
+                              worker TEXT,
+                              lease REAL,
+                              attempts INTEGER NOT NULL DEFAULT 0,
+                              results TEXT,
+                              error TEXT)""")
+
+    return connection
+
+def publishJob(queuefile, scenario, lines, fileEnding, member = None):
+    """
+    publishJob adds one scenario job to the queue.  Use clearQueue before publishing a new run.
+
+    Inputs:
+    queuefile = SQLite queue file (in a directory shared by the coordinator and the workers)
+    scenario = Scenario name
+    lines = List of lines for the assembled geometry file (from rasutils.buildGeometry)
+    fileEnding = Geometry extension of the terrain option (from rasutils.buildGeometry)
+    member = Ensemble member number (see rasensemble), returned with the results.  None for scenario runs
+
+    Return:
+    jobId = Id of the job in the queue
+
+    """
+
+    payload = json.dumps({"lines": list(lines), "fileEnding": fileEnding})
+    connection = openQueue(queuefile)
+    cursor = connection.execute("INSERT INTO jobs (scenario, member, payload) VALUES (?, ?, ?)", (scenario, member, payload))
+    jobId = cursor.lastrowid
+    connection.close()
+
+    return jobId
+
+def clearQueue(queuefile):
+    """
+    clearQueue removes every job from the queue, so jobs and results left over from an earlier (or stopped) run
+    aren't mixed with a new run.  Workers still running an old job can't complete it since the job no longer exists.
+
+    """
+
+    connection = openQueue(queuefile)
+    connection.execute("DELETE FROM jobs")
+    connection.close()
+
+def publishScenarios(queuefile, optionsfile = "", scenariosfile = ""):
+    """
+    publishScenarios assembles the geometry for every scenario in the scenarios file and publishes
+    one job per scenario to the queue.  The coordinator must have the terrain geometry files listed in the options file.
+    The queue is cleared first (see clearQueue).
+
+    Inputs:
+    queuefile = SQLite queue file (in a directory shared by the coordinator and the workers)
+    optionsfile = Text file that includes the terrain and geometry options (culverts, bridges, etc.)
+    scenariosfile =  Text file that includes the scenario combinations by number
+
+    Return:
+    jobIds = Dictionary where the key is the scenario name and the value is the job id
+
+    """
+
+    allOptionsKeys, allOptions = rasutils.readOptions(optionsfile) # HEC-RAS options
+    scenarioOptions = rasutils.readScenarios(scenariosfile) # Scenario combinations
+
+    clearQueue(queuefile) # Start a new run
+    jobIds = {}
+    for scenario, options in scenarioOptions.items():
+        lines, fileEnding = rasutils.buildGeometry(allOptionsKeys, allOptions, options) # Geometry file for the scenario
+        jobIds[scenario] = publishJob(queuefile, scenario, lines, fileEnding)
+
+    return jobIds
+
+def requeueExpired(connection, maxAttempts = 3):
+    """
+    requeueExpired puts jobs whose lease has expired (the worker stopped sending heartbeats) back on the queue.
+    Jobs that have already been tried maxAttempts times are marked as failed instead.
+    Must be called inside a transaction on the connection.
+
+    """
+
+    now = time.time()
+    connection.execute("""UPDATE jobs SET status = 'failed', worker = NULL, lease = NULL, error = 'Lease expired'
+                          WHERE status = 'running' AND lease < ? AND attempts >= ?""", (now, maxAttempts))
+    connection.execute("""UPDATE jobs SET status = 'pending', worker = NULL, lease = NULL
+                          WHERE status = 'running' AND lease < ?""", (now,))
+
+def claimJob(queuefile, workerName, leaseTime = 600, maxAttempts = 3):
+    """
+    claimJob gives the next pending job to the worker (workerName) with a lease of leaseTime seconds.
+    Jobs that have been tried fewer times are claimed first, so a job that failed goes to the back of the queue.
+    The lease must be renewed with renewLease before it runs out or the job is put back on the queue.
+
+    Return:
+    job = Dictionary with the job id, scenario, member, geometry lines, and fileEnding, or None if no jobs are pending
+
+    """
+
+    connection = openQueue(queuefile)
+    try:
+        connection.execute("BEGIN IMMEDIATE") # Lock the queue so two workers can't claim the same job
+        requeueExpired(connection, maxAttempts)
+        row = connection.execute("SELECT id, scenario, member, payload FROM jobs WHERE status = 'pending' ORDER BY attempts, id LIMIT 1").fetchone()
+        if row is not None:
+            connection.execute("""UPDATE jobs SET status = 'running', worker = ?, lease = ?, attempts = attempts + 1
+                                  WHERE id = ?""", (workerName, time.time() + leaseTime, row[0]))
+        connection.execute("COMMIT")
+    except:
+        if connection.in_transaction:
+            connection.execute("ROLLBACK")
+        raise
+    finally:
+        connection.close()
+
+    if row is None:
+        return None
+
+    job = json.loads(row[3])
+    job["id"] = row[0]
+    job["scenario"] = row[1]
+    job["member"] = row[2]
+
+    return job
+
+def renewLease(queuefile, jobId, workerName, leaseTime = 600):
+    """
+    renewLease is the worker heartbeat.  It extends the lease on a job the worker is running.
+    Returns False if the worker no longer holds the job (the lease expired and the job was requeued).
+
+    """
+
+    connection = openQueue(queuefile)
+    cursor = connection.execute("UPDATE jobs SET lease = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                                (time.time() + leaseTime, jobId, workerName))
+    updated = cursor.rowcount == 1
+    connection.close()
+
+    return updated
+
+def completeJob(queuefile, jobId, workerName, results):
+    """
+    completeJob stores the results for a job and marks it as done.
+
+    Inputs:
+    results = Dictionary where the key is the metric name (see metrics) and the value is a dictionary
+              of the result at each location
+
+    Return:
+    True if the results were stored, False if the worker no longer holds the job
+
+    """
+
+    connection = openQueue(queuefile)
+    cursor = connection.execute("""UPDATE jobs SET status = 'done', lease = NULL, results = ?
+                                   WHERE id = ? AND worker = ? AND status = 'running'""",
+                                (json.dumps(results), jobId, workerName))
+    updated = cursor.rowcount == 1
+    connection.close()
+
+    return updated
+
+def failJob(queuefile, jobId, workerName, error, maxAttempts = 3):
+    """
+    failJob puts a job that raised an error back on the queue, or marks it as failed once it has been tried maxAttempts times.
+
+    """
+
+    connection = openQueue(queuefile)
+    connection.execute("""UPDATE jobs SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                          worker = NULL, lease = NULL, error = ?
+                          WHERE id = ? AND worker = ? AND status = 'running'""",
+                       (maxAttempts, error, jobId, workerName))
+    connection.close()
+
+########################## WORKER ##########################
+
+def compactResults(results, scenario):
+    """
+    compactResults converts the results dictionaries from rasutils.calculateResults (keyed by (location, scenario)) to
+    a dictionary of plain numbers keyed by metric name and location, so they can be stored in the queue.
+
+    """
+
+    compact = {}
+    for metric, values in zip(metrics, results):
+        compact[metric] = {location: float(value) for (location, name), value in values.items() if name == scenario}
+
+    return compact
+
+def retryQueue(workerName, retries, wait, function, *args):
+    """
+    retryQueue calls a queue function (i.e. claimJob or completeJob) and tries again when the queue file can't be used
+    (sqlite3.OperationalError, i.e. "database is locked" on a network share), waiting longer after each try.
+
+    Inputs:
+    workerName = Name of the worker, for the messages
+    retries = Number of times to try again before the error is raised
+    wait = Seconds to wait after the first error.  The wait goes up by this much after each error
+    function, args = Queue function and its inputs
+
+    Return:
+    Return value of the function
+
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return function(*args)
+        except sqlite3.OperationalError as error:
+            if attempt == retries:
+                raise
+            print (workerName + ": " + function.__name__ + " failed: " + repr(error) + ", trying again")
+            time.sleep(wait*(attempt + 1))
+
+def runWorker(queuefile, minDepth, geometryfile = "", RASfile = "", cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = "",
+              projectDir = "", workerName = "", leaseTime = 600, heartbeat = 60, poll = 10, maxAttempts = 3, maxFailures = 3, queueRetries = 5, runModel = rasutils.runHEC, stopWhenEmpty = True):
+    """
+    runWorker claims scenario jobs from the queue, runs them, and returns the results to the queue until no jobs are left.
+    Each worker must have its own copy of the HEC-RAS project (projectDir) since the geometry files are rewritten for every run.
+
+    Inputs:
+    queuefile = SQLite queue file (in a directory shared by the coordinator and the workers)
+    minDepth, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile = Same as rasutils.runHECResults
+    projectDir = Directory with this worker's copy of the HEC-RAS project.  File names above are relative to it
+    workerName = Name of the worker in the queue.  Defaults to the computer name and process id
+    leaseTime = Seconds a claimed job stays with the worker without a heartbeat.  Must be longer than heartbeat
+    heartbeat = Seconds between lease renewals while a job is running
+    poll = Seconds to wait before checking the queue again when no jobs are pending
+    maxAttempts = Number of times a job is tried before it is marked as failed
+    maxFailures = Number of jobs in a row that can fail on this worker before it stops, so a broken worker
+                  (missing files, HEC-RAS not working) doesn't use up the attempts of every job in the queue.
+                  The worker waits longer after each failure in a row
+    queueRetries = Number of times a queue call is tried again when the queue file is locked or can't be reached (see retryQueue).
+                   Results of a finished run are tried twice as many times before they are given up
+    runModel = Function that runs the model, called with RASfile.  Defaults to rasutils.runHEC.  Can be
+               replaced with a mock that writes a results file to test the queue without HEC-RAS
+    stopWhenEmpty = Stop once every job in the queue is finished.  Otherwise keep waiting for new jobs
+
+    Return:
+    completed = Number of jobs completed by this worker
+
+    """
+
+    if workerName == "":
+        workerName = socket.gethostname() + "-" + str(os.getpid())
+
+    # Put the terrain file back if this worker was stopped during a run
+    if rasutils.restoreTerrain(os.path.join(projectDir, geometryfile)):
+        print (workerName + ": terrain file restored from a stopped run")
+
+    completed = 0
+    failures = 0 # Jobs in a row that failed on this worker
+    while True:
+        job = retryQueue(workerName, queueRetries, poll, claimJob, queuefile, workerName, leaseTime, maxAttempts)
+        if job is None:
+            if stopWhenEmpty and not retryQueue(workerName, queueRetries, poll, jobsRemaining, queuefile):
+                break
+            time.sleep(poll) # Jobs are still running on other workers and may be requeued
+            continue
+        print (workerName + ": " + job["scenario"])
+
+        # Renew the lease in the background while HEC-RAS runs
+        finished = threading.Event()
+        def renew():
+            while not finished.wait(heartbeat):
+                try:
+                    renewLease(queuefile, job["id"], workerName, leaseTime)
+                except Exception as error: # i.e. queue file locked on a network share, try again at the next heartbeat
+                    print (workerName + ": heartbeat failed: " + repr(error))
+        heartbeatThread = threading.Thread(target = renew, daemon = True)
+        heartbeatThread.start()
+
+        try:
+            results = rasutils.runScenario(job["scenario"], job["lines"], job["fileEnding"], minDepth,
+                                           os.path.join(projectDir, geometryfile), os.path.join(projectDir, RASfile),
+                                           os.path.join(projectDir, cellsfile), os.path.join(projectDir, facesfile),
+                                           os.path.join(projectDir, faceptsfile), os.path.join(projectDir, HECresultsfile), runModel)
+        except Exception as error:
+            finished.set()
+            heartbeatThread.join()
+            print (workerName + ": " + job["scenario"] + " failed: " + repr(error))
+            retryQueue(workerName, queueRetries, poll, failJob, queuefile, job["id"], workerName, repr(error), maxAttempts)
+            failures += 1
+            if failures >= maxFailures:
+                print (workerName + ": stopping after " + str(failures) + " failed jobs in a row")
+                break
+            time.sleep(poll*failures) # Back off before claiming the next job
+            continue
+
+        failures = 0
+        # Keep trying for longer (with the heartbeat still running) so a finished run isn't thrown away and run again
+        try:
+            if retryQueue(workerName, 2*queueRetries, poll, completeJob, queuefile, job["id"], workerName, compactResults(results, job["scenario"])):
+                completed += 1
+        finally:
+            finished.set()
+            heartbeatThread.join()
+
+    return completed
+
+########################## COORDINATOR ##########################
+
+def jobsRemaining(queuefile):
+    """
+    jobsRemaining returns the number of jobs that are pending or running.
+
+    """
+
+    connection = openQueue(queuefile)
+    remaining = connection.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')").fetchone()[0]
+    connection.close()
+
+    return remaining
+
+def iterResults(queuefile, poll = 10, maxAttempts = 3):
+    """
+    iterResults yields the results of each job as soon as a worker finishes it, until no jobs are pending or running.
+    Collected jobs are marked so each result is only yielded once, and their results are removed from the queue.
+    Jobs from workers that stopped sending heartbeats are put back on the queue while waiting.
+
+    Yields:
+    scenario, member, results = Scenario name, ensemble member (None for scenario runs), and the results dictionary
+                                from the worker (see completeJob)
+
+    """
+
+    while True:
+        connection = openQueue(queuefile)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            requeueExpired(connection, maxAttempts)
+            rows = connection.execute("SELECT id, scenario, member, results FROM jobs WHERE status = 'done' ORDER BY id").fetchall()
+            connection.executemany("UPDATE jobs SET status = 'collected', results = NULL WHERE id = ?", [(row[0],) for row in rows])
+            connection.execute("COMMIT")
+        except:
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+        for jobId, scenario, member, results in rows:
+            yield scenario, member, json.loads(results)
+
+        if not rows:
+            if not jobsRemaining(queuefile):
+                break
+            time.sleep(poll)
+
+def collectResults(queuefile, poll = 10, maxAttempts = 3):
+    """
+    collectResults waits for the workers to finish every job in the queue and returns the results in the same
+    format as rasutils.runHECResults, so they can be used in the results analysis.
+    Raises a RuntimeError listing the scenarios that failed on every attempt, since the results analysis
+    (percent difference compared to Scenario 1, plot labels) needs every scenario.
+
+    Return:
+    depth, velocity, duration, percent_time_innundated, stream_power = Dictionaries where the key is
+    (location, scenario) and the value is the result at that location
+
+    """
+
+    allResults = {metric: {} for metric in metrics}
+    for scenario, member, results in iterResults(queuefile, poll, maxAttempts):
+        for metric in metrics:
+            for location, value in results[metric].items():
+                allResults[metric][(location, scenario)] = value
+
+    connection = openQueue(queuefile)
+    failed = connection.execute("SELECT scenario, error FROM jobs WHERE status = 'failed' ORDER BY id").fetchall()
+    connection.close()
+    if failed:
+        raise RuntimeError("Scenarios failed: " + "; ".join(scenario + " (" + str(error) + ")" for scenario, error in failed))
+
+    return tuple(allResults[metric] for metric in metrics)
@@ -1,7 +1,10 @@
 #Import functions 
 import numpy as np
 import h5py
-import win32com.client
+try:
+    import win32com.client # HEC-RAS Controller (Windows only)
+except ImportError: # Results can still be calculated and queue workers tested without HEC-RAS
+    win32com = None
 import os
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -32,30 +35,17 @@ def getLocations(fileName):
        
        return locations
         
-def runHECResults(minDepth, optionsfile = "", scenariosfile = "", geometryfile = "", RASfile = "", cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = "" ):
+def readOptions(optionsfile):
     """
-    runHECResults takes the inputs for HEC-RAS file, scenarios, and results locations.  HEC-RAS runs 
-    through each scenario and calculates depth, velocity, stream power, percent time inundated, and 
-    duration using the HEC-RAS hdf file.  
+    readOptions reads the terrain and geometry options from the options file. 
     
     Inputs: 
-    minDepth = Minimum depth value to be considered inundated or "wet"
     optionsfile = Text file that includes the terrain and geometry options (culverts, bridges, etc.)
-    scenariosfile =  Text file that includes the scenario combinations by number 
-    geometryfile =  Starting geometry file template for HEC-RAS
-    RASfile = HEC-RAS project file 
-    cellsfile = Cell numbers for each location 
-    facesfile = Face numbers for each of the cells
-    faceptsfile = Face point numbers for each of the cells
-    HECresultsfile = Results file, must be the same file that is loaded into model running
-  
+    
     Return: 
-    depth = Calculated depth results at each location
-    velocity = Calculated velocity results at each location
-    duration = Calculated duration results at each location
-    percent_time_innundated = Calculated percent time inundated at each location
-    stream_power = Calculated percent time inundated at each location (only valid in stream though. Results can then
-                                                                       be altered for plots to only include those locations)
+    allOptionsKeys = Array of the names for all the options, in the order they are listed in the file
+    allOptions = Dictionary where the key is the option name and the value is the terrain file name 
+                 (terrain options) or the list of lines to insert in the geometry file (structure options)
     
     """
     
@@ -106,8 +96,17 @@ def runHECResults(minDepth, optionsfile = "", scenariosfile = "", geometryfile =
     
     # Close file
     optionsInfile.close()
+    
+    allOptionsKeys = np.array(allOptionsKeys) # These are the names for all the options
+    
+    return allOptionsKeys, allOptions
 
-########################## Scenarios ########################## 
+def readScenarios(scenariosfile):
+    """
+    readScenarios reads the scenarios file and returns a dictionary (scenarioOptions) where the key is the 
+    scenario name and the value is the list of option numbers for that scenario, i.e. [1, 6, 7, 8].
+    
+    """
     
     scenarioOptions = {} # Dictionary to hold the scenario options
     scenarioInfile = open(scenariosfile,'r') # Open scenarios file
@@ -123,8 +122,96 @@ def runHECResults(minDepth, optionsfile = "", scenariosfile = "", geometryfile =
         scenarioOptions[key] = list(map(int,value.split(','))) # Map the options to a list of integers
         
     scenarioInfile.close() # Close file 
+    
+    return scenarioOptions
+
+def buildGeometry(allOptionsKeys, allOptions, options):
+    """
+    buildGeometry assembles the geometry file for one scenario.  The terrain option (first option) picks the 
+    geometry text file and the structure options are inserted into it. 
+    
+    Inputs: 
+    allOptionsKeys = Names for all the options (from readOptions)
+    allOptions = Dictionary of the option values (from readOptions)
+    options = List of option numbers for the scenario, i.e. [1, 6, 7, 8]
+    
+    Return: 
+    lines = List of lines for the assembled geometry file 
+    fileEnding = Geometry extension of the terrain option, i.e. .g06.  The geometry HDF file with this 
+                 extension holds the terrain for the scenario
+    
+    """
+    
+    choices = allOptionsKeys[np.array(options)-1] # All possible choices we do -1 for indexing since 
+    # the options start at 1. For example [1,2,3,4]-1 = [0,1,2,3]
+    
+    # Open the geometry file and read it into a list for each line
+    geometryInfile = open(allOptions[choices[0]].split('\n')[0],'r')
+    lines = geometryInfile.readlines()
+    geometryInfile.close() # Close file
+    
+    geometryHDFfile = allOptions[choices[0]] # Pick terrain file
+    fileEnding  = os.path.splitext(geometryHDFfile)[1] # Split the file name and get the extension value
+    fileEnding = fileEnding.replace('\n', '') # Delete extra new line 
+    
+    index = 0 # Index to know where to insert
+    for line in lines:
+        if "rating curve" in line.lower(): # This is where to put the options below this
+            # Once you get to this spot insert options
+            for geoChoiceName in choices[1:]: # Insert all options
+                # Insert all options into list at index, by passing the key (name) to the dictionary
+                lines[index:index] = allOptions[geoChoiceName]
+            break
+        
+        index+=1
+    
+    return lines, fileEnding
+
+def runHEC(RASfile):
+    """
+    runHEC opens the HEC-RAS project (RASfile), computes the current plan, and closes HEC-RAS once 
+    the computation is complete. 
+    
+    """
+    
+    # HEC-RAS Controller Code referenced from "Application of Python Scripting 
+    # Techniques for Control and Automation of HEC-RAS Simulations" by Tomasz Dysarz 2018
    
-    allOptionsKeys = np.array(allOptionsKeys) # These are the names for all the options
+    if win32com is None:
+        raise RuntimeError("HEC-RAS Controller (pywin32) is not available on this computer")
+
+    # RAS Controller for HEC-RAS 5.07
+    hec = win32com.client.Dispatch("RAS507.HECRASController")
+    hec.ShowRas()
+    # HEC-RAS file name
+    RASProject = os.path.join(os.getcwd(), RASfile) # Name of HEC-RAS file 
+    try:
+        hec.Project_Open(RASProject) 
+        hec.Compute_CurrentPlan()
+        while hec.Compute_Complete() == False: # Compute each scenario before closing and starting next scenario
+            continue    
+    finally:
+        hec.QuitRas() # Close HEC-RAS, even if the compute failed
+        del hec # Delete HEC-RAS controller
+
+def calculateResults(scenario, minDepth, cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = ""):
+    """
+    calculateResults reads the HEC-RAS results hdf file for one scenario and calculates depth, velocity, 
+    duration, percent time inundated, and stream power at each location. 
+    
+    Inputs: 
+    scenario = Scenario name, used in the keys of the returned dictionaries
+    minDepth = Minimum depth value to be considered inundated or "wet"
+    cellsfile = Cell numbers for each location 
+    facesfile = Face numbers for each of the cells
+    faceptsfile = Face point numbers for each of the cells
+    HECresultsfile = Results file for the scenario 
+    
+    Return: 
+    depth, velocity, duration, percent_time_innundated, stream_power = Dictionaries where the key is 
+    (location, scenario) and the value is the result at that location
+    
+    """
     
     # Create dictionaries for results files
     percent_time_innundated = {} # Percent time innundated 
@@ -133,188 +220,259 @@ def runHECResults(minDepth, optionsfile = "", scenariosfile = "", geometryfile =
     velocity = {} # Velocity 
     stream_power = {} # Stream power 
     
-    # Go through all the different scenarios 
-    # Scenario is the scenario name
-    # Options is the list of options that correspond in the allOptions dictionary
-    
-    for scenario, options in scenarioOptions.items(): 
-        choices = allOptionsKeys[np.array(options)-1] # All possible choices we do -1 for indexing since 
-        # the options start at 1. For example [1,2,3,4]-1 = [0,1,2,3]
-        print (scenario)    
-        
-        # Open the geometry file and read it into a list for each line
-        geometryInfile = open(allOptions[choices[0]].split('\n')[0],'r')
-        lines = geometryInfile.readlines()
-        geometryInfile.close() # Close file
-        
-        # Save the geometry HDF file to the .g01 extension 
-        # The geometry HDF file includes the terrain so the extension must 
-        # match the geometry text file which is saved as .g01 for all runs
-        # The geometry HDF file is then saved back to its' original extension at the end of the loop 
-        # so that it can be used in future scenarios 
-        finalHDF = geometryfile +'.g01.hdf' # Geometry HDF file name for HEC-RAS runs that include correct terrain for the scenario
-        geometryHDFfile = allOptions[choices[0]] # Pick terrain file
-        fileEnding  = os.path.splitext(geometryHDFfile)[1] # Split the file name and get the extension value
-        fileEnding = fileEnding.replace('\n', '') # Delete extra new line 
-        
-        geometryOrigHDF = geometryfile + fileEnding +'.hdf'  # Split the geometry HDF file for the particular scenario
-        splitHDFname = os.path.splitext(geometryOrigHDF)[0] # Split name and take off .hdf
-        splitagain = os.path.splitext(splitHDFname)[0] # Split name and toke off .g0#
-        os.rename(geometryOrigHDF, splitagain + '.g01' + '.hdf') # Resave file as the geometry file .g01.hdf to be used as the terrain file for that scenario run
+    # Pathes are required to the locations in the HDF where each of the evaluation parameters are stored
+    # Update as needed to the variables desired
+    pathnameDepth = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Depth" # Path to Depth in HDF results file
+    pathnameVelocity = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Face Velocity" # Path to Velocity in HDF results file
+    pathnameShearStress = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Face Shear Stress" # Path to Shear Stress in HDF results file
+    pathnameVelocity_X = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Node X Vel" # Path to Velocity Node X in HDF results file
+    pathnameVelocity_Y = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Node Y Vel" # Path to Velocity Node Y in HDF results file
+   
+    # cellLocations holds all the cell locations where the key is 
+    # the location name and the values are a list of the cells
+    cellLocations = getLocations(cellsfile)
+    # faceLocations holds all the face locations where the key is 
+    # the location name and the values are a list of the faces
+    faceLocations = getLocations(facesfile)
+    # facepoints holds all the face point values for each cell
+    # where the key is the location name and the values are a list of the face points
+    facePoints = getLocations(faceptsfile)
+    
+    # Reads the results .p#.HDF file specifed in the driver
+    hecFile = h5py.File(HECresultsfile, 'r') # Creates a dictonary type object of HEC-RAS results file
+    
+    # Each evaluation parameter reads the results HDF file at the paths specified above 
+    dataDepth = hecFile[pathnameDepth] # Depth
+    dataVelocity = hecFile[pathnameVelocity] # Velocity
+    dataShearStress = hecFile[pathnameShearStress] # Shear stress 
+    dataVelocity_X = hecFile[pathnameVelocity_X] # Velocity Node X
+    dataVelocity_Y = hecFile[pathnameVelocity_Y] # Velocity Node Y
+    
+# CALCULATE PERCENT TIME INUNDATED AND DURATION 
+# Use cell values to calculate percent time inundated and duration
+# If cells are "wet" count as inundated (cell value for depth is greater than zero or can specify
+# another minimum depth value (minDepth))
+    
+    for location, cellFaces in cellLocations.items():
+        total = 0 # Initialize total variable for percent time inundated calculation
+        totalDuration = 0 # Initialize totalDuration variable for duration calculation 
+        for cellFace in cellFaces:
+            inundatedTimesHEC = dataDepth[:,cellFace] # Cell face index 
+            inundatedTimes = inundatedTimesHEC[()] > minDepth # Check if depth is greater than the minimum depth at each time step for each cell
+            numInundated = np.count_nonzero(inundatedTimes) # If depth of a cell is greater than minimum depth, will show a 1 so add up the ones
+            percentInundated = numInundated/inundatedTimesHEC.size # Calculate percent time inundated by dividing by total inundated time steps
+            total += percentInundated # Keep track of percent time inundated
+            totalDuration += numInundated # Keep track of duration 
         
-        index = 0 # Index to know where to insert
-        for line in lines:
-            if "rating curve" in line.lower(): # This is where to put the options below this
-                # Once you get to this spot insert options
-                for geoChoiceName in choices[1:]: # Insert all options
-                    # Insert all options into list at index, by passing the key (name) to the dictionary
-                    lines[index:index] = allOptions[geoChoiceName]
-                break
+        percent_time_innundated[(location, scenario)] = (total/len(cellFaces))*100 # Percent Time Innundated for each location and scenario
+        duration[(location, scenario)] =   (totalDuration/len(cellFaces))    # Duration for each location and scenario
             
-            index+=1
-                    
-        # Open edited geometry file with added random options from above 
-        geometryOutfile = open(geometryfile + '.g01','w') # Saved template geometry file  
-        geometryOutfile.writelines(lines)
-        geometryOutfile.close() # Close file
-        
-        ########################## RUN HEC-RAS ########################## 
-        
-        # HEC-RAS Controller Code referenced from "Application of Python Scripting 
-        # Techniques for Control and Automation of HEC-RAS Simulations" by Tomasz Dysarz 2018
-       
-        # RAS Controller for HEC-RAS 5.07
-        hec = win32com.client.Dispatch("RAS507.HECRASController")
-        hec.ShowRas()
-        # HEC-RAS file name
-        RASProject = os.path.join(os.getcwd(), RASfile) # Name of HEC-RAS file 
-        hec.Project_Open(RASProject) 
-        hec.Compute_CurrentPlan()
-        while hec.Compute_Complete() == False: # Compute each scenario before closing and starting next scenario
-            continue    
-        
-        ########################## CALCULATE RESULTS ########################## 
-        
-        # Pathes are required to the locations in the HDF where each of the evaluation parameters are stored
-        # Update as needed to the variables desired
-        pathnameDepth = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Depth" # Path to Depth in HDF results file
-        pathnameVelocity = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Face Velocity" # Path to Velocity in HDF results file
-        pathnameShearStress = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Face Shear Stress" # Path to Shear Stress in HDF results file
-        pathnameVelocity_X = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Node X Vel" # Path to Velocity Node X in HDF results file
-        pathnameVelocity_Y = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/Node Y Vel" # Path to Velocity Node Y in HDF results file
+# CALCULATE DEPTH
+# Use cell values to calculate depth
+# Depth values are calculated by cell in HEC-RAS hdf file 
+# Take maximum depth value for each cell specified for each location and find the average to get an 
+# average depth value for each location  
+    for location, cellFaces in cellLocations.items():
+        total = 0 # Initialize total variable for depth calculation 
+        for cellFace in cellFaces:
+            dataDepthCell = dataDepth[:,cellFace] # Cell face index 
+            total += max(dataDepthCell[()]) # Take depth value for cell 
+        depth[(location, scenario)] = total/len(cellFaces) # Average depth value for each location 
+
+# CALCULATE STREAM POWER 
+# Use cell face values to calculate stream power
+# Velocity and shear stress are calculated at each cell face value in the HEC-RAS hdf file 
+# Stream power is calculated as velocity times shear stress in HEC-RAS but is not calculated
+# explicitly in the hdf file
+# To calculate stream power for each face value, the maximum shear stress is multiplied by the maximum velocity at each time step
+# The maximum stream power value is calculated for each of the cell faces for each of the locations
+# The maximum cell face value is considered the stream power for the location
+
+    for location, faces in faceLocations.items():
+        maxStreampower = 0 # Initialize maxStreampower variable for stream power calculation 
        
-        # cellLocations holds all the cell locations where the key is 
-        # the location name and the values are a list of the cells
-        cellLocations = getLocations(cellsfile)
-        # faceLocations holds all the face locations where the key is 
-        # the location name and the values are a list of the faces
-        faceLocations = getLocations(facesfile)
-        # facepoints holds all the face point values for each cell
-        # where the key is the location name and the values are a list of the face points
-        facePoints = getLocations(faceptsfile)
-        
-        # Reads the results .p#.HDF file specifed in the driver
-        hecFile = h5py.File(HECresultsfile, 'r') # Creates a dictonary type object of HEC-RAS results file
-        
-        # Each evaluation parameter reads the results HDF file at the path specified above (lines 200-204)
-        dataDepth = hecFile[pathnameDepth] # Depth
-        dataVelocity = hecFile[pathnameVelocity] # Velocity
-        dataShearStress = hecFile[pathnameShearStress] # Shear stress 
-        dataVelocity_X = hecFile[pathnameVelocity_X] # Velocity Node X
-        dataVelocity_Y = hecFile[pathnameVelocity_Y] # Velocity Node Y
-        
-    # CALCULATE PERCENT TIME INUNDATED AND DURATION 
-    # Use cell values to calculate percent time inundated and duration
-    # If cells are "wet" count as inundated (cell value for depth is greater than zero or can specify
-    # another minimum depth value (minDepth))
-        
-        for location, cellFaces in cellLocations.items():
-            total = 0 # Initialize total variable for percent time inundated calculation
-            totalDuration = 0 # Initialize totalDuration variable for duration calculation 
-            for cellFace in cellFaces:
-                inundatedTimesHEC = dataDepth[:,cellFace] # Cell face index 
-                inundatedTimes = inundatedTimesHEC[()] > minDepth # Check if depth is greater than the minimum depth at each time step for each cell
-                numInundated = np.count_nonzero(inundatedTimes) # If depth of a cell is greater than minimum depth, will show a 1 so add up the ones
-                percentInundated = numInundated/inundatedTimesHEC.size # Calculate percent time inundated by dividing by total inundated time steps
-                total += percentInundated # Keep track of percent time inundated
-                totalDuration += numInundated # Keep track of duration 
+        for face in faces:
+            dataShearFace = dataShearStress[:,face] # Cell face index for shear stress
+            maxShear = max(abs(dataShearFace)) # Take maximum of absolute value of face shear stress over model time frame
+            dataVelocityFace = dataVelocity[:,face] # Cell face index for face veloicty 
+            maxVelocityFace = max(abs(dataVelocityFace)) # Take maximum of absolute value of face velocity over model time frame
             
-            percent_time_innundated[(location, scenario)] = (total/len(cellFaces))*100 # Percent Time Innundated for each location and scenario
-            duration[(location, scenario)] =   (totalDuration/len(cellFaces))    # Duration for each location and scenario
-                
-    # CALCULATE DEPTH
-    # Use cell values to calculate depth
-    # Depth values are calculated by cell in HEC-RAS hdf file 
-    # Take maximum depth value for each cell specified for each location and find the average to get an 
-    # average depth value for each location  
-        for location, cellFaces in cellLocations.items():
-            total = 0 # Initialize total variable for depth calculation 
-            for cellFace in cellFaces:
-                dataDepthCell = dataDepth[:,cellFace] # Cell face index 
-                total += max(dataDepthCell[()]) # Take depth value for cell 
-            depth[(location, scenario)] = total/len(cellFaces) # Average depth value for each location 
-    
-    # CALCULATE STREAM POWER 
-    # Use cell face values to calculate stream power
-    # Velocity and shear stress are calculated at each cell face value in the HEC-RAS hdf file 
-    # Stream power is calculated as velocity times shear stress in HEC-RAS but is not calculated
-    # explicitly in the hdf file
-    # To calculate stream power for each face value, the maximum shear stress is multiplied by the maximum velocity at each time step
-    # The maximum stream power value is calculated for each of the cell faces for each of the locations
-    # The maximum cell face value is considered the stream power for the location
-    
-        for location, faces in faceLocations.items():
-            maxStreampower = 0 # Initialize maxStreampower variable for stream power calculation 
+            newMaxStreampower = (maxShear*maxVelocityFace) # Stream power = shear stress * velocity for each cell face for each time step
+            
+            # Keep maximum cell face value for each location
+            if newMaxStreampower > maxStreampower:
+                maxStreampower= newMaxStreampower
            
-            for face in faces:
-                dataShearFace = dataShearStress[:,face] # Cell face index for shear stress
-                maxShear = max(abs(dataShearFace)) # Take maximum of absolute value of face shear stress over model time frame
-                dataVelocityFace = dataVelocity[:,face] # Cell face index for face veloicty 
-                maxVelocityFace = max(abs(dataVelocityFace)) # Take maximum of absolute value of face velocity over model time frame
+        stream_power[(location, scenario)] = maxStreampower # Stream Power is equal to the maximum cell face value for each location
+    
+      # CALCULATE VELOCITY
+      # Velocity is calculated using the face points Node X and Node Y values 
+      # The maximum values at each face point was found over the time series
+      # The Pythagorean Theorem is used to find the resultant velocity between the Node X and Node Y values
+      # The maximum face point resultant vecotr for each location is considered the velocity for that cell 
+            
+    for location, facePts in facePoints.items():
+            maxVelocity = 0 # Initialize maxVelocity variable for velocity calculation 
+            for facePt in facePts:
+                dataVelocityFace_X = np.array(dataVelocity_X[:,facePt]) # Cell face index for X node
+                dataVelocityFace_Y = np.array(dataVelocity_Y[:,facePt]) # Cell face index for Y node
+                
+                max_X = max(abs(dataVelocityFace_X)) # Take maximum of absolute value of velocity for node X over model time frame
+                max_Y = max(abs(dataVelocityFace_Y))  # Take maximum of absolute value of velocity for node y over model time frame
                 
-                newMaxStreampower = (maxShear*maxVelocityFace) # Stream power = shear stress * velocity for each cell face for each time step
+                # Use Pythagorean Theorem to find resultant velocity 
+                velocity_XY = np.sqrt(max_X**2 + max_Y**2)
                 
-                # Keep maximum cell face value for each location
-                if newMaxStreampower > maxStreampower:
-                    maxStreampower= newMaxStreampower
+                newMaxVelocity = velocity_XY # Take resultant velocity vector as maximum for that face point
                
-            stream_power[(location, scenario)] = maxStreampower # Stream Power is equal to the maximum cell face value for each location
-        
-          # CALCULATE VELOCITY
-          # Velocity is calculated using the face points Node X and Node Y values 
-          # The maximum values at each face point was found over the time series
-          # The Pythagorean Theorem is used to find the resultant velocity between the Node X and Node Y values
-          # The maximum face point resultant vecotr for each location is considered the velocity for that cell 
+                # Keep maximum face point value for each location
+                if newMaxVelocity > maxVelocity:
+                    maxVelocity = newMaxVelocity
                 
-        for location, facePts in facePoints.items():
-                maxVelocity = 0 # Initialize maxVelocity variable for velocity calculation 
-                for facePt in facePts:
-                    dataVelocityFace_X = np.array(dataVelocity_X[:,facePt]) # Cell face index for X node
-                    dataVelocityFace_Y = np.array(dataVelocity_Y[:,facePt]) # Cell face index for Y node
-                    
-                    max_X = max(abs(dataVelocityFace_X)) # Take maximum of absolute value of velocity for node X over model time frame
-                    max_Y = max(abs(dataVelocityFace_Y))  # Take maximum of absolute value of velocity for node y over model time frame
-                    
-                    # Use Pythagorean Theorem to find resultant velocity 
-                    velocity_XY = np.sqrt(max_X**2 + max_Y**2)
-                    
-                    newMaxVelocity = velocity_XY # Take resultant velocity vector as maximum for that face point
-                   
-                    # Keep maximum face point value for each location
-                    if newMaxVelocity > maxVelocity:
-                        maxVelocity = newMaxVelocity
-                    
-                velocity[(location, scenario)] = maxVelocity # Maximum velocity of the face points of each cell is consideedr the velocity for that location 
-        
+            velocity[(location, scenario)] = maxVelocity # Maximum velocity of the face points of each cell is consideedr the velocity for that location 
+    
+    
+    hecFile.close() # Close the HEC-RAS file
+    
+    return depth, velocity, duration, percent_time_innundated, stream_power
+
+def runScenario(scenario, lines, fileEnding, minDepth, geometryfile = "", RASfile = "", cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = "", runModel = runHEC):
+    """
+    runScenario writes the assembled geometry file for one scenario, runs the model, and calculates the 
+    results. 
+    
+    Inputs: 
+    scenario = Scenario name
+    lines = List of lines for the assembled geometry file (from buildGeometry)
+    fileEnding = Geometry extension of the terrain option (from buildGeometry)
+    minDepth, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile = Same as runHECResults
+    runModel = Function that runs the model, called with RASfile.  Defaults to runHEC 
+    
+    Return: 
+    depth, velocity, duration, percent_time_innundated, stream_power = Results for the scenario (from calculateResults)
+    
+    """
+    
+    # Save the geometry HDF file to the .g01 extension 
+    # The geometry HDF file includes the terrain so the extension must 
+    # match the geometry text file which is saved as .g01 for all runs
+    # The geometry HDF file is then saved back to its' original extension at the end 
+    # so that it can be used in future scenarios 
+    finalHDF = geometryfile +'.g01.hdf' # Geometry HDF file name for HEC-RAS runs that include correct terrain for the scenario
+    
+    # Record the original extension so restoreTerrain can rename the file back if the run is stopped before the end
+    markerOutfile = open(finalHDF + '.terrain','w')
+    markerOutfile.write(fileEnding)
+    markerOutfile.close()
+    
+    geometryOrigHDF = geometryfile + fileEnding +'.hdf'  # Split the geometry HDF file for the particular scenario
+    splitHDFname = os.path.splitext(geometryOrigHDF)[0] # Split name and take off .hdf
+    splitagain = os.path.splitext(splitHDFname)[0] # Split name and toke off .g0#
+    os.rename(geometryOrigHDF, splitagain + '.g01' + '.hdf') # Resave file as the geometry file .g01.hdf to be used as the terrain file for that scenario run
+    
+    try:
+        # Open edited geometry file with added options 
+        geometryOutfile = open(geometryfile + '.g01','w') # Saved template geometry file  
+        geometryOutfile.writelines(lines)
+        geometryOutfile.close() # Close file
         
-        hecFile.close() # Close the HEC-RAS file
-        hec.QuitRas() # Close HEC-RAS
-        del hec # Delete HEC-RAS controller
+        runModel(RASfile) # Run HEC-RAS
         
+        results = calculateResults(scenario, minDepth, cellsfile, facesfile, faceptsfile, HECresultsfile)
+    finally:
         # Geometry HDF file must be saved back to it's original extension in order to be used for other scenarios 
         splitfinalHDFname = os.path.splitext(finalHDF)[0]  # Split name and take off .hdf
         splitagainfinal = os.path.splitext(splitfinalHDFname)[0] # Split name and toke off .g0#
         os.rename(finalHDF, splitagainfinal +  fileEnding + '.hdf')  # Resave file with the original geometry HDF file extension 
+        os.remove(finalHDF + '.terrain')
+    
+    return results
+
+def restoreTerrain(geometryfile = ""):
+    """
+    restoreTerrain renames the terrain geometry HDF file back to its original extension if a run was stopped 
+    (crash, power loss, HEC-RAS closed from the task manager) while it was saved as the .g01.hdf file.  
+    runScenario records the original extension in the .g01.hdf.terrain marker file.  Must be called before 
+    removing the .g01.hdf file so the terrain isn't deleted. 
+    
+    Return: 
+    True if the terrain file was renamed back
+    
+    """
+    
+    finalHDF = geometryfile +'.g01.hdf' # Geometry HDF file name for HEC-RAS runs
+    markerfile = finalHDF + '.terrain' # Marker file with the original extension
+    if not os.path.exists(markerfile):
+        return False
+    
+    markerInfile = open(markerfile,'r')
+    fileEnding = markerInfile.read().strip()
+    markerInfile.close()
+    
+    restored = False
+    geometryOrigHDF = geometryfile + fileEnding + '.hdf' # Original terrain file name
+    # Only rename if the terrain isn't already at its original name (run stopped before the first rename)
+    if os.path.exists(finalHDF) and not os.path.exists(geometryOrigHDF):
+        os.rename(finalHDF, geometryOrigHDF)
+        restored = True
+    os.remove(markerfile)
+    
+    return restored
+        
+def runHECResults(minDepth, optionsfile = "", scenariosfile = "", geometryfile = "", RASfile = "", cellsfile = "", facesfile = "", faceptsfile = "", HECresultsfile = "" ):
+    """
+    runHECResults takes the inputs for HEC-RAS file, scenarios, and results locations.  HEC-RAS runs 
+    through each scenario and calculates depth, velocity, stream power, percent time inundated, and 
+    duration using the HEC-RAS hdf file.  
+    
+    Inputs: 
+    minDepth = Minimum depth value to be considered inundated or "wet"
+    optionsfile = Text file that includes the terrain and geometry options (culverts, bridges, etc.)
+    scenariosfile =  Text file that includes the scenario combinations by number 
+    geometryfile =  Starting geometry file template for HEC-RAS
+    RASfile = HEC-RAS project file 
+    cellsfile = Cell numbers for each location 
+    facesfile = Face numbers for each of the cells
+    faceptsfile = Face point numbers for each of the cells
+    HECresultsfile = Results file, must be the same file that is loaded into model running
+  
+    Return: 
+    depth = Calculated depth results at each location
+    velocity = Calculated velocity results at each location
+    duration = Calculated duration results at each location
+    percent_time_innundated = Calculated percent time inundated at each location
+    stream_power = Calculated percent time inundated at each location (only valid in stream though. Results can then
+                                                                       be altered for plots to only include those locations)
+    
+    """
+    
+    allOptionsKeys, allOptions = readOptions(optionsfile) # HEC-RAS options
+    scenarioOptions = readScenarios(scenariosfile) # Scenario combinations 
+    
+    # Create dictionaries for results files
+    percent_time_innundated = {} # Percent time innundated 
+    duration = {} # Duration 
+    depth = {} # Depth
+    velocity = {} # Velocity 
+    stream_power = {} # Stream power 
+    
+    # Go through all the different scenarios 
+    # Scenario is the scenario name
+    # Options is the list of options that correspond in the allOptions dictionary
+    
+    for scenario, options in scenarioOptions.items(): 
+        print (scenario)    
+        
+        lines, fileEnding = buildGeometry(allOptionsKeys, allOptions, options) # Geometry file for the scenario
+        
+        # Run HEC-RAS and calculate the results for the scenario
+        results = runScenario(scenario, lines, fileEnding, minDepth, geometryfile, RASfile, cellsfile, facesfile, faceptsfile, HECresultsfile)
+        
+        depth.update(results[0])
+        velocity.update(results[1])
+        duration.update(results[2])
+        percent_time_innundated.update(results[3])
+        stream_power.update(results[4])
         
     return depth, velocity, duration, percent_time_innundated, stream_power 
    
@@ -0,0 +1,25 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# Modules are in the top folder of the repository
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repoDir)
+
+from mockras import makeTerrain
+
+@pytest.fixture
+def coordinator(tmp_path, monkeypatch):
+    """
+    Coordinator folder with the repository's Options.txt, the terrain geometry files, and 9 scenarios.
+
+    """
+
+    monkeypatch.chdir(tmp_path)
+    shutil.copy(os.path.join(repoDir, "Options.txt"), "Options.txt")
+    makeTerrain(str(tmp_path))
+    open("Scenarios.txt", "w").write("".join("Scenario %d: %d, 6, 7\n" % (k, k % 5 + 1) for k in range(1, 10)))
+
+    return tmp_path
@@ -0,0 +1,57 @@
+import os
+import re
+
+import h5py
+import numpy as np
+
+# Mock HEC-RAS project and model runs for testing the queue and ensembles without HEC-RAS
+
+resultsPath = "Results/Unsteady/Output/Output Blocks/Base Output/Unsteady Time Series/2D Flow Areas/2D Flow/"
+terrainFiles = ["OriginalScenario.g06", "Scenario5_1Terrain.g02", "Scenario5_2Terrain.g03", "Scenario5_5Terrain.g04", "NewScenario7.g05"]
+
+def makeTerrain(directory):
+    """
+    Terrain geometry files listed in Options.txt, for the coordinator.
+
+    """
+
+    for terrain in terrainFiles:
+        open(os.path.join(directory, terrain), "w").write("Geom Title=Model\nConn Outlet Rating Curve= 0\nEnd\n")
+
+def makeProject(projectDir):
+    """
+    Worker copy of the project: terrain geometry HDF files and the location files.
+
+    """
+
+    os.makedirs(projectDir)
+    for terrain in terrainFiles:
+        open(os.path.join(projectDir, "Model" + os.path.splitext(terrain)[1] + ".hdf"), "w").write("terrain")
+    for locationsfile in ["cells.txt", "faces.txt", "facepts.txt"]:
+        open(os.path.join(projectDir, locationsfile), "w").write("Location 1: 1,2\nLocation 2: 3\n")
+
+def writeResults(projectDir, scale):
+    hecFile = h5py.File(os.path.join(projectDir, "Model.p01.hdf"), "w")
+    for name in ["Depth", "Face Velocity", "Face Shear Stress", "Node X Vel", "Node Y Vel"]:
+        hecFile[resultsPath + name] = np.linspace(0, scale, 200).reshape(20, 10)
+    hecFile.close()
+
+def mockModel(RASfile):
+    """
+    Results depend on the number of structures in the assembled geometry file.
+
+    """
+
+    projectDir = os.path.dirname(RASfile)
+    geometry = open(os.path.join(projectDir, "Model.g01")).read()
+    writeResults(projectDir, 1 + geometry.count("Connection="))
+
+def manningModel(RASfile):
+    """
+    Results are proportional to the sum of the culvert bottom Manning's n in the assembled geometry file.
+
+    """
+
+    projectDir = os.path.dirname(RASfile)
+    geometry = open(os.path.join(projectDir, "Model.g01")).read()
+    writeResults(projectDir, 100*sum(float(n) for n in re.findall(r"Conn Culv Bottom n=([\d.]+)", geometry)))
@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+
+import rasensemble
+import rasqueue
+import rasutils
+from mockras import makeProject, manningModel
+
+def test_running_stats_matches_numpy():
+    values = np.random.default_rng(1).normal(3, 2, 5000)
+    stats = rasensemble.RunningStats()
+    for value in values:
+        stats.add(value)
+
+    assert stats.count == 5000
+    assert stats.mean == pytest.approx(np.mean(values), rel = 1e-12)
+    assert stats.variance() == pytest.approx(np.var(values, ddof = 1), rel = 1e-10)
+    assert stats.std() == pytest.approx(np.std(values, ddof = 1), rel = 1e-10)
+    assert (stats.min, stats.max) == (values.min(), values.max())
+
+def test_running_stats_with_one_value():
+    stats = rasensemble.RunningStats([0.5])
+    stats.add(4)
+
+    assert stats.mean == 4 and stats.quantile(0.5) == 4
+    assert np.isnan(stats.variance()) and all(np.isnan(stats.interval()))
+
+def test_running_stats_leaves_out_non_finite_values():
+    values = [1.0, 2.0, 4.0, 7.0, 11.0, 16.0, 22.0, 29.0, 37.0]
+    stats = rasensemble.RunningStats([0.5])
+    for value in values[:4] + [np.inf, np.nan] + values[4:]:
+        stats.add(value)
+
+    assert stats.count == 9 and stats.nonFinite == 2
+    assert stats.mean == pytest.approx(np.mean(values)) and stats.quantile(0.5) == pytest.approx(np.median(values))
+    assert all(np.isfinite(stats.interval()))
+
+@pytest.mark.parametrize("p", [0.025, 0.5, 0.975])
+def test_p2_quantile_is_exact_up_to_five_values(p):
+    quantile = rasensemble.P2Quantile(p)
+    values = [3.0, 1.0, 4.0, 1.5, 9.0]
+    for count, value in enumerate(values, 1):
+        quantile.add(value)
+        assert quantile.value() == pytest.approx(np.percentile(values[:count], p*100))
+
+@pytest.mark.parametrize("p", [0.025, 0.5, 0.975])
+def test_p2_quantile_matches_numpy_for_large_samples(p):
+    values = np.random.default_rng(2).normal(0, 1, 20000)
+    quantile = rasensemble.P2Quantile(p)
+    for value in values:
+        quantile.add(value)
+
+    assert quantile.value() == pytest.approx(np.percentile(values, p*100), abs = 0.03)
+
+@pytest.mark.parametrize("dof, expected", [(1, 12.7062), (2, 4.3027), (3, 3.1824), (9, 2.2622), (29, 2.0452), (99, 1.9842)])
+def test_student_t_quantiles(dof, expected):
+    assert rasensemble.studentT(0.975, dof) == pytest.approx(expected, rel = 2e-3)
+    assert rasensemble.studentT(0.025, dof) == pytest.approx(-expected, rel = 2e-3)
+
+def test_interval_is_t_prediction_interval():
+    values = [1.0, 2.0, 4.0, 7.0, 11.0, 16.0, 22.0, 29.0, 37.0, 46.0]
+    stats = rasensemble.RunningStats()
+    for value in values:
+        stats.add(value)
+
+    halfWidth = 2.2622*np.std(values, ddof = 1)*np.sqrt(1 + 1/10)
+    lower, upper = stats.interval(0.025, 0.975)
+    assert lower == pytest.approx(np.mean(values) - halfWidth, rel = 1e-3)
+    assert upper == pytest.approx(np.mean(values) + halfWidth, rel = 1e-3)
+
+def test_perturb_geometry_culvert_lines(coordinator):
+    allOptionsKeys, allOptions = rasutils.readOptions("Options.txt")
+    lines = allOptions[allOptionsKeys[5]] # Option 6 (East Culvert)
+    matched = set()
+    perturbed = rasensemble.perturbGeometry(lines, {"Conn Culv Bottom n": 1.2, "Connection Culv:4": 0.5}, matched)
+
+    assert "Conn Culv Bottom n=0.036\n" in perturbed
+    assert "Connection Culv=1,0.81,,12.49,0.0165,0.5,1,2,3,110.3,110.3, 1 ,import #0   , 0 ,\n" in perturbed
+    assert matched == {"Conn Culv Bottom n", "Connection Culv:4"}
+    changed = [line for line, new in zip(lines, perturbed) if line != new]
+    assert [line.split("=")[0] for line in changed] == ["Connection Culv", "Conn Culv Bottom n"]
+
+@pytest.mark.parametrize("key", ["Connection Culv:2", "Connection Culv:40", "Connection Desc"])
+def test_perturb_geometry_reports_key_and_line(key):
+    lines = ["Connection Desc=\n", "Connection Culv=1,0.81,,12.49,0.033\n"]
+    with pytest.raises(ValueError, match = "Perturbation " + key + " is not a number in line: Connection "):
+        rasensemble.perturbGeometry(lines, {key: 1.1})
+
+def test_ensemble_members_unmatched_keys(coordinator, capsys):
+    open("Scenarios2.txt", "w").write("Scenario 1: 1, 6\nScenario 2: 1, 11\n")
+    with pytest.raises(ValueError, match = "Conn Culv Bottom N"):
+        list(rasensemble.ensembleMembers("Options.txt", "Scenarios2.txt", {"Conn Culv Bottom N": 0.2}, 2))
+
+    # Cell size is only in the east culvert option, not the small culvert
+    capsys.readouterr()
+    members = list(rasensemble.ensembleMembers("Options.txt", "Scenarios2.txt", {"Conn CellSize Min": 0.2}, 2))
+    assert [(member, scenario) for member, scenario, lines, fileEnding in members] == \
+           [(0, "Scenario 1"), (0, "Scenario 2"), (1, "Scenario 1"), (1, "Scenario 2")]
+    assert capsys.readouterr().out == "Scenario 2: perturbation Conn CellSize Min matches no line in the geometry\n"
+
+def test_percent_difference_uses_same_member_baseline():
+    ensemble = rasensemble.EnsembleStats(["Scenario 1", "Scenario 2"], quantiles = [0.5])
+    # Member 1 of Scenario 2 arrives before member 1 of Scenario 1
+    ensemble.add("Scenario 1", 0, {"depth": {"Location 1": 1.0, "Location 2": 0.0}})
+    ensemble.add("Scenario 2", 1, {"depth": {"Location 1": 4.0, "Location 2": 1.0}})
+    ensemble.add("Scenario 2", 0, {"depth": {"Location 1": 2.0, "Location 2": 1.0}})
+    assert ensemble.waiting == {1: [("Scenario 2", {"depth": {"Location 1": 4.0, "Location 2": 1.0}})]}
+    ensemble.add("Scenario 1", 1, {"depth": {"Location 1": 2.0, "Location 2": 0.0}})
+    assert ensemble.baselines == {} and ensemble.waiting == {} and ensemble.folded == {}
+
+    tables = rasensemble.ensembleTables(ensemble.stats, "depth percent difference", 0.5, 0.5)
+    assert list(tables["mean"].columns) == ["Location 1", "Location 2"] # Zero baseline location kept
+    assert tables["mean"].loc["Scenario 1", "Location 1"] == 0
+    assert tables["mean"].loc["Scenario 2", "Location 1"] == 100
+    assert tables["std"].loc["Scenario 2", "Location 1"] == 0
+    # Baseline of 0 for both members, the inf percent differences are counted and left out
+    assert tables["count"].loc["Scenario 2", "Location 2"] == 0 and tables["nonFinite"].loc["Scenario 2", "Location 2"] == 2
+    assert np.isnan(tables["mean"].loc["Scenario 2", "Location 2"]) and np.isnan(tables["median"].loc["Scenario 2", "Location 2"])
+    assert tables["nonFinite"].loc["Scenario 2", "Location 1"] == 0
+    assert rasensemble.ensembleTables(ensemble.stats, "depth", 0.5, 0.5)["mean"].loc["Scenario 2", "Location 1"] == 3
+
+def test_members_with_failed_baseline_are_reported(capsys):
+    ensemble = rasensemble.EnsembleStats(["Scenario 1", "Scenario 2", "Scenario 3"], quantiles = [0.5])
+    ensemble.add("Scenario 1", 0, {"depth": {"Location 1": 1.0}})
+    ensemble.add("Scenario 2", 0, {"depth": {"Location 1": 2.0}})
+    # Member 1's Scenario 1 failed
+    ensemble.add("Scenario 3", 1, {"depth": {"Location 1": 3.0}})
+    ensemble.add("Scenario 2", 1, {"depth": {"Location 1": 4.0}})
+    capsys.readouterr()
+
+    assert ensemble.finish() == [("Scenario 3", 1), ("Scenario 2", 1)]
+    assert capsys.readouterr().out == "Scenario 3, member 1: percent difference skipped: baseline failed\n" \
+                                      "Scenario 2, member 1: percent difference skipped: baseline failed\n"
+    assert ensemble.waiting == {} and ensemble.baselines == {}
+    assert ensemble.stats[("depth", "Location 1", "Scenario 2")].count == 2
+    assert ensemble.stats[("depth percent difference", "Location 1", "Scenario 2")].count == 1
+
+def test_queue_and_local_ensembles_agree(coordinator):
+    open("Scenarios2.txt", "w").write("Scenario 1: 1, 6\nScenario 2: 1, 6, 7\n")
+    perturbations = {"Conn Culv Bottom n": 0.2}
+    projectDir = str(coordinator / "worker")
+    makeProject(projectDir)
+
+    queuefile = str(coordinator / "ensemble.db")
+    rasqueue.publishJob(queuefile, "Scenario 1", [], ".g06", 99) # Left over from an earlier run
+    assert rasensemble.publishEnsemble(queuefile, "Options.txt", "Scenarios2.txt", perturbations, 12, seed = 4) == 24
+    rasqueue.runWorker(queuefile, 0.5, "Model", "Model.prj", "cells.txt", "faces.txt", "facepts.txt", "Model.p01.hdf",
+                       projectDir = projectDir, poll = 0, runModel = manningModel)
+    queueStats = rasensemble.collectEnsemble(queuefile, "Scenarios2.txt", poll = 0)
+
+    localStats = rasensemble.runEnsemble(0.5, "Options.txt", "Scenarios2.txt", projectDir + "/Model", projectDir + "/Model.prj",
+                                         projectDir + "/cells.txt", projectDir + "/faces.txt", projectDir + "/facepts.txt",
+                                         projectDir + "/Model.p01.hdf", perturbations, 12, seed = 4, runModel = manningModel)
+
+    assert sorted(queueStats) == sorted(localStats)
+    for key in localStats:
+        assert queueStats[key].count == 12
+        assert queueStats[key].mean == pytest.approx(localStats[key].mean)
+    tables = rasensemble.ensembleTables(localStats, "depth")
+    assert (tables["std"] > 0).all().all() and (tables["normalLower"] < tables["lower"]).all().all()
+    # Scenario 2 has twice the culvert Manning's n of the same member, so the percent difference has no spread
+    tables = rasensemble.ensembleTables(localStats, "depth percent difference")
+    assert tables["mean"].loc["Scenario 2"].tolist() == pytest.approx([100, 100])
+    assert tables["std"].loc["Scenario 2"].tolist() == pytest.approx([0, 0], abs = 1e-9)
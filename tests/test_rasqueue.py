@@ -0,0 +1,190 @@
+import multiprocessing
+import os
+import sqlite3
+
+import pytest
+
+import rasqueue
+import rasutils
+from mockras import makeProject, mockModel, terrainFiles
+
+def failingModel(RASfile):
+    raise RuntimeError("HEC-RAS failed")
+
+def dyingModel(RASfile):
+    os._exit(1) # Worker stops without returning the job
+
+def worker(queuefile, projectDir, model, leaseTime = 600):
+    rasqueue.runWorker(queuefile, 0.5, "Model", "Model.prj", "cells.txt", "faces.txt", "facepts.txt", "Model.p01.hdf",
+                       projectDir = projectDir, leaseTime = leaseTime, heartbeat = 0.2, poll = 0.1, runModel = model)
+
+def runWorkers(queuefile, projectDirs, models, leaseTime = 600):
+    processes = [multiprocessing.Process(target = worker, args = (queuefile, projectDir, model, leaseTime))
+                 for projectDir, model in zip(projectDirs, models)]
+    for process in processes:
+        process.start()
+
+    return processes
+
+def test_workers_complete_all_scenarios(coordinator):
+    queuefile = str(coordinator / "queue.db")
+    jobIds = rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios.txt")
+    projectDirs = [str(coordinator / ("worker%d" % i)) for i in range(4)]
+    for projectDir in projectDirs:
+        makeProject(projectDir)
+
+    processes = runWorkers(queuefile, projectDirs, [mockModel]*4)
+    depth, velocity, duration, percent_time_innundated, stream_power = rasqueue.collectResults(queuefile, poll = 0.1)
+    for process in processes:
+        process.join(30)
+
+    assert len(jobIds) == 9
+    assert sorted(depth) == sorted((location, scenario) for scenario in jobIds for location in ["Location 1", "Location 2"])
+    # Scenario 1 has the east and west culverts (3 structures with the template), Scenario 2 has the same
+    assert depth[("Location 2", "Scenario 1")] == depth[("Location 2", "Scenario 2")]
+    for projectDir in projectDirs: # Terrain files renamed back and no markers left
+        assert sorted(name for name in os.listdir(projectDir) if ".hdf" in name and name != "Model.p01.hdf") == \
+               sorted("Model" + os.path.splitext(terrain)[1] + ".hdf" for terrain in terrainFiles)
+
+def test_dead_worker_job_is_requeued(coordinator):
+    queuefile = str(coordinator / "queue.db")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios.txt")
+    projectDirs = [str(coordinator / ("worker%d" % i)) for i in range(3)]
+    for projectDir in projectDirs:
+        makeProject(projectDir)
+
+    processes = runWorkers(queuefile, projectDirs, [dyingModel, mockModel, mockModel], leaseTime = 1)
+    results = rasqueue.collectResults(queuefile, poll = 0.1)
+    for process in processes:
+        process.join(30)
+
+    assert len(set(scenario for location, scenario in results[0])) == 9
+    connection = sqlite3.connect(queuefile)
+    assert connection.execute("SELECT MAX(attempts) FROM jobs").fetchone()[0] == 2
+    connection.close()
+    # The stopped worker's terrain is renamed back on its next start
+    assert os.path.exists(os.path.join(projectDirs[0], "Model.g01.hdf.terrain"))
+    assert rasutils.restoreTerrain(os.path.join(projectDirs[0], "Model"))
+    assert not os.path.exists(os.path.join(projectDirs[0], "Model.g01.hdf"))
+
+def test_expired_lease_is_reclaimed_and_stale_completion_rejected(tmp_path):
+    queuefile = str(tmp_path / "queue.db")
+    rasqueue.publishJob(queuefile, "Scenario 1", ["Geom Title=Model\n"], ".g06")
+
+    stale = rasqueue.claimJob(queuefile, "stale", leaseTime = -1) # Lease already expired
+    assert rasqueue.claimJob(queuefile, "other", leaseTime = -1)["id"] == stale["id"]
+    fresh = rasqueue.claimJob(queuefile, "fresh")
+    assert fresh["id"] == stale["id"] and fresh["lines"] == ["Geom Title=Model\n"] and fresh["fileEnding"] == ".g06"
+    assert rasqueue.claimJob(queuefile, "idle") is None
+
+    assert not rasqueue.renewLease(queuefile, stale["id"], "stale")
+    assert not rasqueue.completeJob(queuefile, stale["id"], "stale", {"depth": {"Location 1": 1.0}})
+    assert rasqueue.completeJob(queuefile, fresh["id"], "fresh", {"depth": {"Location 1": 2.0}})
+    assert list(rasqueue.iterResults(queuefile, poll = 0)) == [("Scenario 1", None, {"depth": {"Location 1": 2.0}})]
+
+def test_expired_lease_fails_after_max_attempts(tmp_path):
+    queuefile = str(tmp_path / "queue.db")
+    rasqueue.publishJob(queuefile, "Scenario 1", [], ".g06")
+    for attempt in range(3):
+        assert rasqueue.claimJob(queuefile, "worker", leaseTime = -1, maxAttempts = 3) is not None
+    assert rasqueue.claimJob(queuefile, "worker", maxAttempts = 3) is None
+    with pytest.raises(RuntimeError, match = "Scenario 1 \\(Lease expired\\)"):
+        rasqueue.collectResults(queuefile, poll = 0)
+
+def test_failing_worker_stops_and_failed_scenarios_raise(coordinator):
+    queuefile = str(coordinator / "queue.db")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios.txt")
+    projectDir = str(coordinator / "worker")
+    makeProject(projectDir)
+
+    worker(queuefile, projectDir, failingModel) # Stops after 3 failed jobs in a row
+    connection = sqlite3.connect(queuefile)
+    assert connection.execute("SELECT COUNT(*) FROM jobs WHERE attempts > 0").fetchone()[0] == 3
+    connection.close()
+
+    worker(queuefile, projectDir, mockModel)
+    assert len(rasqueue.collectResults(queuefile, poll = 0)[0]) == 18
+
+    open("Scenarios1.txt", "w").write("Scenario 1: 1, 6, 7\n")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios1.txt")
+    worker(queuefile, projectDir, failingModel)
+    with pytest.raises(RuntimeError, match = "Scenarios failed: Scenario 1 "):
+        rasqueue.collectResults(queuefile, poll = 0)
+
+def test_publish_clears_earlier_run(coordinator):
+    queuefile = str(coordinator / "queue.db")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios.txt")
+    rasqueue.claimJob(queuefile, "worker")
+    jobIds = rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios.txt")
+
+    assert rasqueue.jobsRemaining(queuefile) == 9
+    assert rasqueue.claimJob(queuefile, "worker")["id"] == min(jobIds.values())
+
+def flaky(function, errors):
+    """
+    Queue function that raises "database is locked" the first errors times it is called.
+
+    """
+
+    calls = []
+    def call(*args):
+        calls.append(args)
+        if len(calls) <= errors:
+            raise sqlite3.OperationalError("database is locked")
+        return function(*args)
+    call.__name__ = function.__name__
+
+    return call
+
+def test_worker_retries_locked_queue(coordinator, monkeypatch):
+    queuefile = str(coordinator / "queue.db")
+    open("Scenarios1.txt", "w").write("Scenario 1: 1, 6, 7\n")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios1.txt")
+    projectDir = str(coordinator / "worker")
+    makeProject(projectDir)
+
+    monkeypatch.setattr(rasqueue, "claimJob", flaky(rasqueue.claimJob, 2))
+    monkeypatch.setattr(rasqueue, "completeJob", flaky(rasqueue.completeJob, 7)) # More than queueRetries
+    assert rasqueue.runWorker(queuefile, 0.5, "Model", "Model.prj", "cells.txt", "faces.txt", "facepts.txt", "Model.p01.hdf",
+                              projectDir = projectDir, poll = 0, queueRetries = 5, runModel = mockModel) == 1
+    assert len(rasqueue.collectResults(queuefile, poll = 0)[0]) == 2
+
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios1.txt")
+    monkeypatch.setattr(rasqueue, "claimJob", flaky(rasqueue.claimJob, 10))
+    with pytest.raises(sqlite3.OperationalError, match = "database is locked"):
+        rasqueue.runWorker(queuefile, 0.5, projectDir = projectDir, poll = 0, queueRetries = 2, runModel = mockModel)
+
+def test_claim_closes_connection_when_queue_is_locked(tmp_path, monkeypatch):
+    queuefile = str(tmp_path / "queue.db")
+    rasqueue.publishJob(queuefile, "Scenario 1", [], ".g06")
+    lock = sqlite3.connect(queuefile, isolation_level = None)
+    lock.execute("BEGIN IMMEDIATE")
+
+    connections = []
+    openQueue = rasqueue.openQueue
+    def openQueueNoWait(queuefile):
+        connection = openQueue(queuefile)
+        connection.execute("PRAGMA busy_timeout = 0")
+        connections.append(connection)
+        return connection
+    monkeypatch.setattr(rasqueue, "openQueue", openQueueNoWait)
+
+    with pytest.raises(sqlite3.OperationalError, match = "locked"):
+        rasqueue.claimJob(queuefile, "worker")
+    with pytest.raises(sqlite3.ProgrammingError): # Closed
+        connections[0].execute("SELECT 1")
+    lock.execute("ROLLBACK")
+    assert rasqueue.claimJob(queuefile, "worker") is not None
+
+@pytest.mark.skipif(rasutils.win32com is not None, reason = "HEC-RAS Controller is available")
+def test_worker_without_hec_ras_reports_why(coordinator):
+    queuefile = str(coordinator / "queue.db")
+    open("Scenarios1.txt", "w").write("Scenario 1: 1, 6, 7\n")
+    rasqueue.publishScenarios(queuefile, "Options.txt", "Scenarios1.txt")
+    projectDir = str(coordinator / "worker")
+    makeProject(projectDir)
+
+    rasqueue.runWorker(queuefile, 0.5, "Model", "Model.prj", "cells.txt", "faces.txt", "facepts.txt", "Model.p01.hdf",
+                       projectDir = projectDir, poll = 0, maxAttempts = 1) # Default runModel (rasutils.runHEC)
+    with pytest.raises(RuntimeError, match = "HEC-RAS Controller \\(pywin32\\) is not available"):
+        rasqueue.collectResults(queuefile, poll = 0, maxAttempts = 1)